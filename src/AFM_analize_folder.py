@@ -1,218 +1,300 @@
 import numpy as np
 import pandas as pd
+import matplotlib
+matplotlib.use('Agg')
 import matplotlib.pyplot as plt
 import gudhi
-import statsmodels.api as sm
+from scipy.fft import next_fast_len
 import warnings
 import os
-from rich.progress import track
+from src.parallel import process_files
 warnings.filterwarnings('ignore')
 
-def plot_acf_graph(acf_df_x, acf_df_y, ax_x, ax_y):
-    
-    plt.rc('font', size = 12)          # controls default text sizes
-    plt.rc('axes', titlesize = 17)     # fontsize of the axes title
-    plt.rc('axes', labelsize = 15)     # fontsize of the x and y labels
-    plt.rc('xtick', labelsize = 15)    # fontsize of the tick labels
-    plt.rc('ytick', labelsize = 15)    # fontsize of the tick labels
-    plt.rc('legend', fontsize = 12)    # legend fontsize
+plt.rc('font', size = 12)          # controls default text sizes
+plt.rc('axes', titlesize = 17)     # fontsize of the axes title
+plt.rc('axes', labelsize = 15)     # fontsize of the x and y labels
+plt.rc('xtick', labelsize = 15)    # fontsize of the tick labels
+plt.rc('ytick', labelsize = 15)    # fontsize of the tick labels
+plt.rc('legend', fontsize = 12)    # legend fontsize
+gudhi.persistence_graphical_tools._gudhi_matplotlib_use_tex=False
+
+def plot_acf_graph(acf_df_x, acf_df_y, ax_x, ax_y, ax = None):
     
     acf_df_x = acf_df_x.rename(columns = {'ACF' : 'Along x-direction'})
     acf_df_y = acf_df_y.rename(columns = {'ACF' : 'Along y-direction'})
 
-    plt.figure(figsize = (7, 5))
-    plt.plot('ix', 'Along x-direction', data = acf_df_x, color = 'darkorange', linewidth = 2.5)
-    plt.plot('ix', 'Along y-direction', data = acf_df_y, color = 'royalblue', linewidth = 2.5)
-    plt.axhline(y = 0, xmin = 0, xmax = 1, linestyle = '--', color = 'black')
-    plt.axhline(y = 0.1, xmin = 0, xmax = 1, linestyle = '--', color = 'brown')
-    plt.title(f"Autocorrelation along {ax_x}- and {ax_y}-direction")
-    plt.legend()
-    plt.xlabel('Sampling length, μm')
-    plt.ylabel('Autocorrelation function, C(τ)')
+    if ax is None:
+        _, ax = plt.subplots(figsize = (7, 5))
+    else:
+        ax.clear()
+    ax.plot('ix', 'Along x-direction', data = acf_df_x, color = 'darkorange', linewidth = 2.5)
+    ax.plot('ix', 'Along y-direction', data = acf_df_y, color = 'royalblue', linewidth = 2.5)
+    ax.axhline(y = 0, xmin = 0, xmax = 1, linestyle = '--', color = 'black')
+    ax.axhline(y = 0.1, xmin = 0, xmax = 1, linestyle = '--', color = 'brown')
+    ax.set_title(f"Autocorrelation along {ax_x}- and {ax_y}-direction")
+    ax.legend()
+    ax.set_xlabel('Sampling length, μm')
+    ax.set_ylabel('Autocorrelation function, C(τ)')
+
+_figures = {}
+
+def reusable_figure(name, figsize = None):
+    """
+    Returns figure and axes created once per process and reused for every file
+    """
+    if name not in _figures:
+        _figures[name] = plt.subplots(figsize = figsize)
+    return _figures[name]
+
+FIGURE_FORMATS = ('png', 'svg', 'pdf')
+PNG_DPI = 300
+
+def save_figure(fig, path, formats = FIGURE_FORMATS):
+    """
+    Saves figure as path.<format> for every format, only png is rendered at PNG_DPI
+    """
+    for fmt in formats:
+        if fmt == 'png':
+            fig.savefig(f'{path}.{fmt}', format = fmt, dpi = PNG_DPI, bbox_inches = 'tight')
+        else:
+            fig.savefig(f'{path}.{fmt}', format = fmt, bbox_inches = 'tight')
+
+def load_matrix(path):
+    """
+    Loads a converted AFM csv file (DataLine column included) as a float matrix,
+    the .npy copy saved next to it on the first load is memory-mapped while it is newer than the csv
+    """
+    npy_path = path[:-4] + '.npy'
+    if os.path.exists(npy_path) and os.path.getmtime(npy_path) >= os.path.getmtime(path):
+        return np.load(npy_path, mmap_mode = 'r')
+    X = np.loadtxt(path, delimiter = ',', skiprows = 1, dtype = np.float64, ndmin = 2)
+    # write next to the target and rename, so an interrupted save never leaves a truncated cache behind
+    tmp_path = f'{npy_path}.{os.getpid()}.tmp'
+    try:
+        with open(tmp_path, 'wb') as npy_file:
+            np.save(npy_file, X)
+        os.replace(tmp_path, npy_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return X
+
+def read_dataset(path):
+    """
+    Reads a converted AFM csv file as a float matrix indexed by DataLine
+    """
+    X = load_matrix(path)
+    return pd.DataFrame(X[:, 1:], index = pd.Index(X[:, 0], name = 'DataLine'),
+                        columns = [f'Pos = {i}' for i in range(X.shape[1] - 1)])
+
+def acf_fft(x, nlags):
+    """
+    Autocorrelation function of a series up to nlags computed through FFT
+    """
+    if nlags < 0:
+        raise ValueError('Number of lags cannot be negative.')
+    x = np.asarray(x, dtype = np.float64)
+    x = x - x.mean()
+    n = x.size
+    m = next_fast_len(2 * n - 1, real = True)
+    f = np.fft.rfft(x, m)
+    acov = np.fft.irfft(f * np.conj(f), m)[:min(nlags, n - 1) + 1]
+    return acov / acov[0]
 
-def get_acf(df, nlags, series_no, constant, plot_acf = False):
+def get_acf(df, nlags, series_no, constant, plot_acf = False, ax = None):
 
-    val_x = df[f'Pos = {series_no}'].values
+    val_x = df.iloc[:, series_no].to_numpy()
     ax_x = 'x'
 
-    val_y = df.set_index('DataLine').T.iloc[:, series_no].values
+    val_y = df.iloc[series_no].to_numpy()
     ax_y = 'y'
     
-    auto_corr_x = sm.tsa.stattools.acf(val_x,  
-                                              nlags = nlags, qstat = False, 
-                                              alpha = None)
-    auto_corr_y = sm.tsa.stattools.acf(val_y,  
-                                              nlags = nlags, qstat = False, 
-                                              alpha = None)
+    auto_corr_x = acf_fft(val_x, nlags)
+    auto_corr_y = acf_fft(val_y, nlags)
     
-    acf_df_x = pd.DataFrame({'z' : val_x, 
+    ix = np.arange(auto_corr_x.size, dtype = np.float64) * constant
+
+    acf_df_x = pd.DataFrame({'z' : val_x[:ix.size], 
                            'ACF' : auto_corr_x, 
-                           'ix' : [i * constant for i in range(0, len(auto_corr_x))],
-                           'Series' : [series_no] * len(auto_corr_x),
-                           'Axis' : [ax_x] * len(auto_corr_x)})
+                           'ix' : ix})
+    acf_df_x['Series'] = series_no
+    acf_df_x['Axis'] = ax_x
     
-    acf_df_y = pd.DataFrame({'z' : val_y, 
+    acf_df_y = pd.DataFrame({'z' : val_y[:ix.size], 
                            'ACF' : auto_corr_y, 
-                           'ix' : [i * constant for i in range(0, len(auto_corr_y))],
-                           'Series' : [series_no] * len(auto_corr_y),
-                           'Axis' : [ax_y] * len(auto_corr_y)})
+                           'ix' : ix})
+    acf_df_y['Series'] = series_no
+    acf_df_y['Axis'] = ax_y
     
     acf_df = pd.concat([acf_df_x, acf_df_y])
     
     if plot_acf == True:
-        plot_acf_graph(acf_df_x, acf_df_y, ax_x, ax_y)
+        plot_acf_graph(acf_df_x, acf_df_y, ax_x, ax_y, ax)
     else:
         pass
     return acf_df
 
-def new_scandir(dirname):
-    """
-    Scanning throught all subfolders and return list of all folders and subfolders
-    """
-    subfolders= [f.path for f in os.scandir(dirname) if f.is_dir()]
-    for dirname in list(subfolders):
-        subfolders.extend(new_scandir(dirname))
-    return subfolders
-
-def clean_path(folder_path):
-    """
-    Transform the path from Windows to Linux
-    """
-    is_prev_slash = False
-    for char in folder_path:
-        if char in '\\' and not is_prev_slash:
-            folder_path = folder_path.replace(char,'/')
-            is_prev_slash = True
-        elif char in '\\' and is_prev_slash:
-            folder_path = folder_path.replace(char, '')
-    folder_path = folder_path[1:]
-    return folder_path
-
-def find_files(directory,filetype):
-    """
-    Creates a list of dataset files
-    """
-    files = []
-    folders = []
-    itemsindir = new_scandir(directory)
-    for item in itemsindir:
-        if item.startswith(directory):
-            clear_item = item.replace(directory,'')
-            clear_item = clean_path(clear_item)+'/'
-        folders.append(clear_item)
-    for folder in folders:
-        for filename in os.listdir(directory+'/'+folder):
-            if filename.endswith(filetype):
-                files.append(directory+'/'+folder+filename)
-    return files
-
-def autocorr_function(datasets, width_line):
-    for a in track(datasets, description="[green]Processing..."):
-        df=pd.read_csv(a)
-        acf_df = get_acf(df = df, nlags = int(len(df)), series_no = int(len(df)/2), constant = width_line, plot_acf = True)
-        acf_df.to_csv((str(a)[:-3]+'_auto.csv'))
-        plt.savefig(str(a)[:-3]+'autocorr_function.png', format='png', dpi=1200, bbox_inches='tight')
-        plt.savefig(str(a)[:-3]+'autocorr_function.svg', format='svg', dpi=1200, bbox_inches='tight')
-        plt.savefig(str(a)[:-3]+'autocorr_function.pdf', format='pdf', dpi=1200, bbox_inches='tight')
+def autocorr_file(a, width_line, max_lag = None):
+    df = read_dataset(a)
+    nlags = len(df) if max_lag is None else min(max_lag, len(df))
+    fig, ax = reusable_figure('acf', (7, 5))
+    acf_df = get_acf(df = df, nlags = nlags, series_no = int(len(df)/2), constant = width_line, plot_acf = True, ax = ax)
+    acf_df.to_csv((str(a)[:-3]+'_auto.csv'))
+    save_figure(fig, str(a)[:-3]+'autocorr_function')
+
+def autocorr_function(datasets, width_line, max_lag = None, max_workers = None):
+    """
+    Saves autocorrelation function of the middle line along x and y for every dataset,
+    max_lag limits the number of lags (the whole line length if None)
+    """
+    process_files(autocorr_file, datasets, width_line, max_lag, max_workers = max_workers)
          
-def persistance_db(datasets, max_edge_length):
-    for a in track(datasets, description="[green]Processing..."):
-        df=pd.read_csv(a)
-
-        X = df.to_numpy()
-
-        gudhi.persistence_graphical_tools._gudhi_matplotlib_use_tex=False
-        # Using default parameters. Change it as required 
-        rips_complex = gudhi.RipsComplex(distance_matrix=X, max_edge_length=max_edge_length) 		#max_edge_length=100, 250
-        simplex_tree = rips_complex.create_simplex_tree(max_dimension=3)
-        diag = simplex_tree.persistence(min_persistence=0)
-        ans = extract_list_from_raw_data(diag)
-        diag_df = pd.DataFrame(ans, columns=["Start", "End", "Length", "Homology group"])
-        diag_df.to_csv((str(a)[:-4]+"diag_df_output.csv"))
-        gudhi.plot_persistence_barcode(diag,fontsize=18, legend=True, inf_delta=0.5, max_intervals=len(diag_df)+1)
-        plt.xlabel('Sampling length, nm', fontsize = 16)
-        plt.ylabel('Topological invariants', fontsize = 18)
-        plt.xticks(fontsize = 16)
-        plt.yticks(fontsize = 0)
-        plt.savefig(str(a)[:-3]+'barcode.png', format='png', dpi=1200, bbox_inches='tight')
-        plt.savefig(str(a)[:-3]+'barcode.svg', format='svg', dpi=1200, bbox_inches='tight')
-        plt.savefig(str(a)[:-3]+'barcode.pdf', format='pdf', dpi=1200, bbox_inches='tight')
+# both backends compute homology with coefficients in Z/11Z, the GUDHI default
+HOMOLOGY_COEFF_FIELD = 11
+
+def has_clique(adjacency, size):
+    """
+    Checks whether the graph given by a boolean adjacency matrix has size mutually connected vertices
+    """
+    if size <= 2:
+        return len(adjacency) >= size and (size < 2 or bool(adjacency.any()))
+    if size == 3:
+        a = adjacency.astype(np.float64)
+        return bool(((a @ a) * a).any())
+    for v in range(len(adjacency)):
+        neighbours = np.flatnonzero(adjacency[v, v + 1:]) + v + 1
+        if len(neighbours) >= size - 1 and has_clique(adjacency[np.ix_(neighbours, neighbours)], size - 1):
+            return True
+    return False
+
+def rips_dimension(D, max_edge_length, max_dimension):
+    """
+    Dimension of the Rips complex of the distance matrix D, i.e. of the largest simplex
+    with all edges not longer than max_edge_length, capped at max_dimension
+    """
+    adjacency = D <= max_edge_length
+    np.fill_diagonal(adjacency, False)
+    dimension = -1
+    while dimension < max_dimension and has_clique(adjacency, dimension + 2):
+        dimension += 1
+    return dimension
+
+def rips_persistence(X, max_edge_length, min_persistence = 0, backend = 'gudhi', max_dimension = 3):
+    """
+    Persistence pairs (dimension, (birth, death)) of the Rips complex built on the lower triangle of X
+    with simplices up to max_dimension (homology up to max_dimension - 1),
+    backend 'ripser' needs the optional ripser package and does not build the simplex tree
+    """
+    if backend == 'ripser':
+        from ripser import ripser
+        n = X.shape[0]
+        D = np.tril(X[:, :n], -1)
+        D = D + D.T
+        dgms = ripser(D, maxdim=max_dimension - 1, thresh=max_edge_length, distance_matrix=True,
+                      coeff=HOMOLOGY_COEFF_FIELD)['dgms']
+        # GUDHI does not report homology in the top dimension of the complex it builds,
+        # drop the same dimensions so both backends return the same intervals
+        dgms = dgms[:rips_dimension(D, max_edge_length, max_dimension)]
+        diag = [(dim, (birth, death)) for dim, dgm in enumerate(dgms)
+                for birth, death in dgm.astype(np.float64).tolist() if death - birth > min_persistence]
+        return sorted(diag, key=lambda pair: (-pair[0], pair[1][0] - pair[1][1]))
+    elif backend != 'gudhi':
+        raise ValueError(f'Unknown persistence backend: {backend}')
+    # Using default parameters. Change it as required 
+    rips_complex = gudhi.RipsComplex(distance_matrix=X, max_edge_length=max_edge_length) 		#max_edge_length=100, 250
+    simplex_tree = rips_complex.create_simplex_tree(max_dimension=max_dimension)
+    return simplex_tree.persistence(homology_coeff_field=HOMOLOGY_COEFF_FIELD, min_persistence=min_persistence)
+
+def persistence_file(a, max_edge_length, min_persistence = 0, backend = 'gudhi', max_dimension = 3):
+    X = load_matrix(a)
+    diag = rips_persistence(X, max_edge_length, min_persistence, backend, max_dimension)
+    diag_df = extract_list_from_raw_data(diag)
+    diag_df.to_csv((str(a)[:-4]+"diag_df_output.csv"))
+    fig, ax = reusable_figure('barcode')
+    ax.clear()
+    gudhi.plot_persistence_barcode(diag,fontsize=18, legend=True, inf_delta=0.5, max_intervals=len(diag_df)+1, axes=ax)
+    ax.set_xlabel('Sampling length, nm', fontsize = 16)
+    ax.set_ylabel('Topological invariants', fontsize = 18)
+    ax.tick_params(axis = 'x', labelsize = 16)
+    ax.tick_params(axis = 'y', labelsize = 0)
+    save_figure(fig, str(a)[:-3]+'barcode')
     
-        gudhi.plot_persistence_diagram(diag,fontsize=18,alpha=0.5,legend=True,inf_delta=0.2, greyblock=False, max_intervals=len(diag_df)+1)
+    fig, ax = reusable_figure('persistence_diagram')
+    ax.clear()
+    gudhi.plot_persistence_diagram(diag,fontsize=18,alpha=0.5,legend=True,inf_delta=0.2, greyblock=False, max_intervals=len(diag_df)+1, axes=ax)
     
-        plt.xlabel('Feature appearance, nm', fontsize = 18)
-        plt.ylabel('Feature disappearance, nm', fontsize = 18)
-        plt.xticks(fontsize = 16)
-        plt.yticks(fontsize = 16)
-        plt.savefig(str(a)[:-3]+'persistence_diagram.png', format='png', dpi=1200, bbox_inches='tight')
-        plt.savefig(str(a)[:-3]+'persistence_diagram.svg', format='svg', dpi=1200, bbox_inches='tight')
-        plt.savefig(str(a)[:-3]+'persistence_diagram.pdf', format='pdf', dpi=1200, bbox_inches='tight')
-
-def return_min_max_ix(m):
-    min_ix = np.unravel_index(m.argmin(), m.shape)
-    max_ix = np.unravel_index(m.argmax(), m.shape)
-    return [min_ix[0], min_ix[1], max_ix[0], max_ix[1]]
-        
-def minmax_db(datasets):
-    for a in track(datasets, description="[green]Processing..."):
-        data = pd.read_csv(a, index_col = 'DataLine')
-        n = 3
-        rows_to_drop = data.shape[0] - int(data.shape[0] / n) * n
-        if rows_to_drop < 0:
-            raise ValueError('Number of rows to drop cannot be negative.')
-        else:
-            pass
-        if rows_to_drop == 0:
-            mat = data.to_numpy()
-        else:
-            mat = data.iloc[:-rows_to_drop, :-rows_to_drop].to_numpy()
-        if mat.shape[0] == mat.shape[1]:
-            pass
-        else:
-            raise ValueError('Please check the dimension of main sqaure matrix.')
-        if mat.shape[0] % n == 0:
-            pass
-        else:
-            raise ValueError('Please check the dimension of smaller sqaure matrix.')
-        i1 = 0
-        i2 = n
-        mat_list = []
-        while i2 <= mat.shape[0]:
-            j1 = 0
-            j2 = n
-            while j2 <= mat.shape[1]:
-                mat_list.append(mat[i1:i2, j1:j2])
-                j1 += n
-                j2 += n
-            i1 += n
-            i2 += n
-
-        sub_mat_df = pd.DataFrame([x.flatten() for x in mat_list],
-                                  columns = [f'ri_{i}_ci_{j}' for i in range(n) for j in range(n)])
-
-        min_max_ix_dict = {k + 1 : return_min_max_ix(m) for k, m in enumerate(mat_list)}
-
-        points = pd.DataFrame.from_dict(min_max_ix_dict).T.rename(columns = { 0 : 'min_r', 1 : 'min_c', 2 : 'max_r', 3 : 'max_c'})
-
-        points.head()
-
-        min_df = points.groupby(['min_r', 'min_c']).size().reset_index()
-        min_df = min_df.rename(columns = {0 : 'X3', 'min_r' : 'r', 'min_c' : 'c'})
-        min_df['type'] = 'min'
-
-        max_df = points.groupby(['max_r', 'max_c']).size().reset_index()
-        max_df = max_df.rename(columns = {0 : 'X3', 'max_r' : 'r', 'max_c' : 'c'})
-        max_df['type'] = 'max'
-
-        points = pd.concat([min_df, max_df])
-
-        points.to_csv(f'{a[:-4]}_min_max_ix({n}x{n}).csv', index = False)
-        sub_mat_df.to_csv(f'{a[:-4]}_flattened_submat({n}x{n}).csv', index = False)
-        
-def extract_list_from_raw_data(diagrams):
-  ans = []
-  for diagram in diagrams:
-    ans.append([diagram[1][0], diagram[1][1], abs(diagram[1][0] - diagram[1][1]), diagram[0]])
+    ax.set_xlabel('Feature appearance, nm', fontsize = 18)
+    ax.set_ylabel('Feature disappearance, nm', fontsize = 18)
+    ax.tick_params(axis = 'both', labelsize = 16)
+    save_figure(fig, str(a)[:-3]+'persistence_diagram')
 
-  return ans
+def persistance_db(datasets, max_edge_length, min_persistence = 0, backend = 'gudhi', max_dimension = 3, max_workers = 1):
+    """
+    Saves persistence intervals, barcode and diagram for every dataset,
+    intervals not longer than min_persistence are dropped before any further processing,
+    max_dimension = 2 skips the H2 intervals and is much cheaper for large max_edge_length,
+    every worker holds a whole Rips complex in memory, so files run one at a time unless max_workers is raised
+    """
+    process_files(persistence_file, datasets, max_edge_length, min_persistence, backend, max_dimension, max_workers = max_workers)
+
+def count_positions(r, c, n, kind):
+    """
+    Counts how many times each cell of an n*n submatrix holds the extremum
+    """
+    counts = np.bincount(r * n + c, minlength = n * n)
+    cells = counts.nonzero()[0]
+    return pd.DataFrame({'r' : cells // n, 'c' : cells % n, 'X3' : counts[cells], 'type' : kind})
 
+def minmax_file(a):
+    data = read_dataset(a)
+    n = 3
+    rows_to_drop = data.shape[0] - int(data.shape[0] / n) * n
+    if rows_to_drop < 0:
+        raise ValueError('Number of rows to drop cannot be negative.')
+    else:
+        pass
+    if rows_to_drop == 0:
+        mat = data.to_numpy()
+    else:
+        mat = data.iloc[:-rows_to_drop, :-rows_to_drop].to_numpy()
+    if mat.shape[0] == mat.shape[1]:
+        pass
+    else:
+        raise ValueError('Please check the dimension of main sqaure matrix.')
+    if mat.shape[0] % n == 0:
+        pass
+    else:
+        raise ValueError('Please check the dimension of smaller sqaure matrix.')
+    b = mat.shape[0] // n
+    blocks = mat.reshape(b, n, b, n).swapaxes(1, 2).reshape(b * b, n, n)
+
+    flat = blocks.reshape(b * b, n * n)
+
+    sub_mat_df = pd.DataFrame(flat,
+                              columns = [f'ri_{i}_ci_{j}' for i in range(n) for j in range(n)])
+
+    min_r, min_c = np.divmod(flat.argmin(axis = 1), n)
+    max_r, max_c = np.divmod(flat.argmax(axis = 1), n)
+
+    min_df = count_positions(min_r, min_c, n, 'min')
+    max_df = count_positions(max_r, max_c, n, 'max')
+
+    points = pd.concat([min_df, max_df], ignore_index = True)
+
+    points.to_csv(f'{a[:-4]}_min_max_ix({n}x{n}).csv', index = False)
+    sub_mat_df.to_csv(f'{a[:-4]}_flattened_submat({n}x{n}).csv', index = False)
+
+def minmax_db(datasets, max_workers = None):
+    process_files(minmax_file, datasets, max_workers = max_workers)
+
+def extract_list_from_raw_data(diagrams):
+    """
+    Converts gudhi persistence pairs to a table of intervals and their homology groups
+    """
+    groups = np.fromiter((diagram[0] for diagram in diagrams), dtype = np.int64, count = len(diagrams))
+    intervals = np.array([diagram[1] for diagram in diagrams], dtype = np.float64).reshape(-1, 2)
+    return pd.DataFrame({'Start' : intervals[:, 0],
+                         'End' : intervals[:, 1],
+                         'Length' : np.abs(intervals[:, 0] - intervals[:, 1]),
+                         'Homology group' : groups})
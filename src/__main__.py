@@ -10,6 +10,14 @@ def main():
     console.print(Markdown("# Starting"))
     width_line = float(input('Enter line width (image length/number of pixels): '))
     max_edge_length = float(input('Enter max edge length for rips (default = 100): '))
+    max_lag = input('Enter max lag for autocorrelation in points (default = whole line): ')
+    max_lag = int(max_lag) if max_lag else None
+    if max_lag is not None and max_lag < 0:
+        raise ValueError('Max lag cannot be negative.')
+    workers = input('Enter number of files to process in parallel for barcodes (default = 1): ')
+    workers = int(workers) if workers else 1
+    if workers < 1:
+        raise ValueError('Number of parallel files must be at least 1.')
     folder, save_path = folder_path()
     list_files_to_convert = list_txt_files(folder)
     console.print(Markdown("# Convering txt files"))
@@ -18,9 +26,9 @@ def main():
     console.print(Markdown("# Creating min/max"))
     minmax_db(list_of_csv_files)
     console.print(Markdown("# Creating autocorrelation fuction"))
-    autocorr_function(list_of_csv_files, width_line)
+    autocorr_function(list_of_csv_files, width_line, max_lag)
     console.print(Markdown("# Creating barcodes and diagrams"))
-    persistance_db(list_of_csv_files, max_edge_length)
+    persistance_db(list_of_csv_files, max_edge_length, max_workers = workers)
     console.print(Markdown("# Finished!"))
 
 if __name__ == '__main__':
@@ -1,36 +1,17 @@
 import numpy as np
 import os
-from rich.progress import track
-
-def matrix_convert_save(dataset, save_path):
-    for file in track(dataset, description="[green]Processing..."):
-        filik = open(file, "r")
-        listik = []
-        for line in filik:
-            stripped_line = line.strip()
-            line_list = stripped_line.split()
-            listik.append(line_list)
-        dfs = listik[4:]
-        dflength = len(dfs)
-        first_line = ['DataLine']
-        for i in range(dflength):
-            first_line.append('Pos = '+str(i))
-        dfs_new = [[float(item)*10**9 for item in list] for list in dfs]
-        j = 0
-        for line in dfs_new:
-            line.insert(0, j)
-            j = j+1
-        dfs_new.insert(0, first_line)
-        file_name = file.split(os.sep)[-1][:-4]
-        if os.path.exists(save_path):
-            pass
-        else:
-            os.mkdir(save_path)
-        if os.path.exists(os.path.join(save_path, file_name)):
-            pass
-        else:
-            os.mkdir(os.path.join(save_path, file_name))
-        np.savetxt(os.path.join(save_path, file_name, (file_name + '.csv')), dfs_new, fmt='%s', delimiter=',')
-
+from src.parallel import process_files
 
+def convert_file(file, save_path):
+    dfs = np.loadtxt(file, skiprows=4, dtype=np.float64, ndmin=2)
+    dfs *= 10**9
+    dflength = len(dfs)
+    first_line = ','.join(['DataLine'] + ['Pos = '+str(i) for i in range(dflength)])
+    file_name = file.split(os.sep)[-1][:-4]
+    os.makedirs(os.path.join(save_path, file_name), exist_ok=True)
+    with open(os.path.join(save_path, file_name, (file_name + '.csv')), 'w') as csv_file:
+        csv_file.write(first_line + '\n')
+        csv_file.writelines(f"{j},{','.join(map(repr, line))}\n" for j, line in enumerate(dfs.tolist()))
 
+def matrix_convert_save(dataset, save_path, max_workers=None):
+    process_files(convert_file, dataset, save_path, max_workers=max_workers)
@@ -1,48 +1,53 @@
-from simple_term_menu import TerminalMenu
 import os
 from pathlib import Path
 
+PROJECT_PATH = Path(__file__).parent.parent
+
 def get_project_path():
-    path = Path(__file__).parent.parent
-    return path
+    return PROJECT_PATH
+
+EXCLUDED_DIRS = {'src', '.idea', '.git', 'venv'}
 
 def folder_path():
-    path_to_folders = []
+    from simple_term_menu import TerminalMenu
+    options = []
     for root, dirs, files in os.walk(get_project_path()):
-        for dir in dirs:
-            path_to_folders.append(os.path.join(root, dir))
-    exeptions = []
-    for path in path_to_folders:
-        if 'src' in path.split(os.sep):
-            exeptions.append(path)
-        elif 'src' in path.split(os.sep):
-            exeptions.append(path)
-        elif '.idea' in path.split(os.sep):
-            exeptions.append(path)
-        elif '.git' in path.split(os.sep):
-            exeptions.append(path)
-        elif 'venv' in path.split(os.sep):
-            exeptions.append(path)
-    options = [i for i in path_to_folders if i not in exeptions]
+        dirs[:] = [dir for dir in dirs if dir not in EXCLUDED_DIRS]
+        options.extend(os.path.join(root, dir) for dir in dirs)
     terminal_menu = TerminalMenu(options)
     menu_entry_index = terminal_menu.show()
     folder = options[menu_entry_index]
     save_path = os.path.join(folder, 'output')
     return folder, save_path
 
-def list_txt_files(folder):
-    list_txt_files = []
-    for root, dirs, files in os.walk(folder):
-        for file in files:
-            if file.endswith('.txt'):
-                list_txt_files.append(os.path.join(root, file))
+def iter_files(folder, suffixes):
+    """
+    Recursively yields paths of files in folder whose lowercased name ends with one of suffixes
+    """
+    stack = [folder]
+    while stack:
+        subfolders = []
+        try:
+            entries = os.scandir(stack.pop())
+        except OSError:
+            # missing or unreadable folders are skipped like os.walk does
+            continue
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    subfolders.append(entry.path)
+                elif entry.name.lower().endswith(suffixes):
+                    yield entry.path
+        stack.extend(reversed(subfolders))
 
-    return list_txt_files
+def iter_txt_files(folder):
+    return iter_files(folder, ('.txt',))
+
+def iter_csv_files(folder):
+    return iter_files(folder, ('.csv',))
+
+def list_txt_files(folder):
+    return list(iter_txt_files(folder))
 
 def list_csv_files(folder):
-    list_csv_files = []
-    for root, dirs, files in os.walk(folder):
-        for file in files:
-            if file.endswith('csv'):
-                list_csv_files.append(os.path.join(root, file))
-    return list_csv_files
+    return list(iter_csv_files(folder))
@@ -0,0 +1,15 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from rich.progress import track
+
+def process_files(func, datasets, *args, max_workers=None):
+    """
+    Calls func(file, *args) for every file in a process pool and shows the progress
+    """
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(func, file, *args) for file in datasets]
+        try:
+            for future in track(as_completed(futures), total=len(futures), description="[green]Processing..."):
+                future.result()
+        except BaseException:
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise